@@ -0,0 +1,18 @@
+try:
+    import orjson
+
+    def json_dumps(obj) -> bytes:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+    json_loads = orjson.loads
+except ImportError:
+    import json
+
+    # ujson only accepts `default` from 5.2 on, so encoding stays on the stdlib module
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, default=str).encode('utf-8')
+
+    try:
+        from ujson import loads as json_loads
+    except ImportError:
+        json_loads = json.loads
@@ -1,7 +1,10 @@
 from __future__ import annotations
+import contextlib
 import datetime
+import functools
 import logging
 import os
+from typing import NamedTuple
 
 import tiktoken
 
@@ -19,6 +22,7 @@ from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_t
 
 from utils import is_direct_result, encode_image, decode_image
 from plugin_manager import PluginManager
+from json_utils import json_loads
 
 # Models can be found here: https://platform.openai.com/docs/models/overview
 # Models gpt-3.5-turbo-0613 and  gpt-3.5-turbo-16k-0613 will be deprecated on June 13, 2024
@@ -31,29 +35,50 @@ GPT_4_128K_MODELS = ("gpt-4-1106-preview","gpt-4-0125-preview","gpt-4-turbo-prev
 GPT_4O_MODELS = ("gpt-4o",)
 GPT_ALL_MODELS = GPT_3_MODELS + GPT_3_16K_MODELS + GPT_4_MODELS + GPT_4_32K_MODELS + GPT_4_VISION_MODELS + GPT_4_128K_MODELS + GPT_4O_MODELS
 
+
+class ModelSpec(NamedTuple):
+    """
+    Token limits and token counting parameters of a model.
+    """
+    max_tokens: int
+    default_max_tokens: int
+    tokens_per_message: int
+    tokens_per_name: int
+
+
+def build_model_specs() -> dict[str, ModelSpec]:
+    """
+    Builds the spec of each supported model. Models listed in more than one family keep the first one.
+    :return: A dictionary mapping each model name to its spec
+    """
+    model_specs = {}
+    for models, spec in ((GPT_3_MODELS, ModelSpec(4096, 1200, 4, -1)),
+                         (GPT_3_16K_MODELS, ModelSpec(4096 * 4, 1200 * 4, 4, -1)),
+                         (GPT_4_MODELS, ModelSpec(4096 * 2, 1200 * 2, 3, 1)),
+                         (GPT_4_32K_MODELS, ModelSpec(4096 * 8, 1200 * 8, 3, 1)),
+                         (GPT_4_VISION_MODELS, ModelSpec(4096 * 31, 4096, 3, 1)),
+                         (GPT_4_128K_MODELS, ModelSpec(4096 * 31, 4096, 3, 1)),
+                         (GPT_4O_MODELS, ModelSpec(4096 * 31, 4096, 3, 1))):
+        for model in models:
+            model_specs.setdefault(model, spec)
+    model_specs["gpt-3.5-turbo-1106"] = model_specs["gpt-3.5-turbo-1106"]._replace(default_max_tokens=4096)
+    return model_specs
+
+
+MODEL_SPECS = build_model_specs()
+
+# Minimum number of texts for which __count_tokens encodes in parallel
+ENCODE_BATCH_MIN_SIZE = 16
+
+
 def default_max_tokens(model: str) -> int:
     """
     Gets the default number of max tokens for the given model.
     :param model: The model name
     :return: The default number of max tokens
     """
-    base = 1200
-    if model in GPT_3_MODELS:
-        return base
-    elif model in GPT_4_MODELS:
-        return base * 2
-    elif model in GPT_3_16K_MODELS:
-        if model == "gpt-3.5-turbo-1106":
-            return 4096
-        return base * 4
-    elif model in GPT_4_32K_MODELS:
-        return base * 8
-    elif model in GPT_4_VISION_MODELS:
-        return 4096
-    elif model in GPT_4_128K_MODELS:
-        return 4096
-    elif model in GPT_4O_MODELS:
-        return 4096
+    spec = MODEL_SPECS.get(model)
+    return spec.default_max_tokens if spec is not None else None
 
 
 def are_functions_available(model: str) -> bool:
@@ -74,11 +99,34 @@ def are_functions_available(model: str) -> bool:
     return True
 
 
-# Load translations
+@functools.lru_cache(maxsize=16)
+def get_encoding(model: str):
+    """
+    Gets the tiktoken encoding for the given model, built once per process.
+    :param model: The model name
+    :return: The encoding for the model, or cl100k_base if the model is unknown to tiktoken
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+# Translations are loaded on first use
 parent_dir_path = os.path.join(os.path.dirname(__file__), os.pardir)
 translations_file_path = os.path.join(parent_dir_path, 'translations.json')
-with open(translations_file_path, 'r', encoding='utf-8') as f:
-    translations = json.load(f)
+
+
+@functools.lru_cache(maxsize=None)
+def get_translations() -> tuple[dict, dict]:
+    """
+    Loads translations.json once and flattens it into a {(bot_language, key): text} lookup table.
+    :return: A tuple of the flattened translations and the english translations
+    """
+    with open(translations_file_path, 'rb') as f:
+        translations = json_loads(f.read())
+    translations_flat = {(lang, key): text for lang, texts in translations.items() for key, text in texts.items()}
+    return translations_flat, translations.get('en', {})
 
 
 def localized_text(key, bot_language):
@@ -86,17 +134,17 @@ def localized_text(key, bot_language):
     Return translated text for a key in specified bot_language.
     Keys and translations can be found in the translations.json.
     """
-    try:
-        return translations[bot_language][key]
-    except KeyError:
-        logging.warning(f"No translation available for bot_language code '{bot_language}' and key '{key}'")
-        # Fallback to English if the translation is not available
-        if key in translations['en']:
-            return translations['en'][key]
-        else:
-            logging.warning(f"No english definition found for key '{key}' in translations.json")
-            # return key as text
-            return key
+    translations_flat, translations_en = get_translations()
+    text = translations_flat.get((bot_language, key))
+    if text is not None:
+        return text
+    logging.warning("No translation available for bot_language code '%s' and key '%s'", bot_language, key)
+    # Fallback to English if the translation is not available
+    if key in translations_en:
+        return translations_en[key]
+    logging.warning("No english definition found for key '%s' in translations.json", key)
+    # return key as text
+    return key
 
 
 class OpenAIHelper:
@@ -110,13 +158,25 @@ class OpenAIHelper:
         :param config: A dictionary containing the GPT configuration
         :param plugin_manager: The plugin manager
         """
-        http_client = httpx.AsyncClient(proxies=config['proxy']) if 'proxy' in config else None
+        # a single pooled client keeps upstream connections alive between requests
+        http_client = httpx.AsyncClient(
+            proxy=config.get('proxy'),
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=60)
+        )
         self.client = openai.AsyncOpenAI(api_key=config['api_key'], http_client=http_client)
         self.config = config
         self.plugin_manager = plugin_manager
-        self.conversations: dict[int: list] = {}  # {chat_id: history}
-        self.conversations_vision: dict[int: bool] = {}  # {chat_id: is_vision}
-        self.last_updated: dict[int: datetime] = {}  # {chat_id: last_update_timestamp}
+        self.conversations: dict[int, list] = {}  # {chat_id: history}
+        self.conversations_vision: dict[int, bool] = {}  # {chat_id: is_vision}
+        self.last_updated: dict[int, datetime.datetime] = {}  # {chat_id: last_update_timestamp}
+        self.token_counts: dict[int, tuple] = {}  # {id(message): (message, token_count)}
+        self.active_requests: dict[int, int] = {}  # {chat_id: number_of_requests_in_flight}
+
+    async def close(self):
+        """
+        Closes the underlying HTTP connection pool.
+        """
+        await self.client.close()
 
     def get_conversation_stats(self, chat_id: int) -> tuple[int, int]:
         """
@@ -135,41 +195,38 @@ class OpenAIHelper:
         :param query: The query to send to the model
         :return: The answer from the model and the number of tokens used
         """
-        plugins_used = ()
-        response = await self.__common_get_chat_response(chat_id, query)
-        if self.config['enable_functions'] and not self.conversations_vision[chat_id]:
-            response, plugins_used = await self.__handle_function_call(chat_id, response)
-            if is_direct_result(response):
-                return response, '0'
-
-        answer = ''
-
-        if len(response.choices) > 1 and self.config['n_choices'] > 1:
-            for index, choice in enumerate(response.choices):
-                content = choice.message.content.strip()
-                if index == 0:
-                    self.__add_to_history(chat_id, role="assistant", content=content)
-                answer += f'{index + 1}\u20e3\n'
-                answer += content
-                answer += '\n\n'
-        else:
-            answer = response.choices[0].message.content.strip()
-            self.__add_to_history(chat_id, role="assistant", content=answer)
+        with self.__request_in_flight(chat_id):
+            plugins_used = ()
+            response = await self.__common_get_chat_response(chat_id, query)
+            if self.config['enable_functions'] and not self.conversations_vision[chat_id]:
+                response, plugins_used = await self.__handle_function_call(chat_id, response)
+                if is_direct_result(response):
+                    return response, '0'
 
-        bot_language = self.config['bot_language']
-        show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
-        plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
-        if self.config['show_usage']:
-            answer += "\n\n---\n" \
-                      f"💰 {str(response.usage.total_tokens)} {localized_text('stats_tokens', bot_language)}" \
-                      f" ({str(response.usage.prompt_tokens)} {localized_text('prompt', bot_language)}," \
-                      f" {str(response.usage.completion_tokens)} {localized_text('completion', bot_language)})"
-            if show_plugins_used:
-                answer += f"\n🔌 {', '.join(plugin_names)}"
-        elif show_plugins_used:
-            answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
-
-        return answer, response.usage.total_tokens
+            answer = ''
+
+            if len(response.choices) > 1 and self.config['n_choices'] > 1:
+                contents = [(choice.message.content or '').strip() for choice in response.choices]
+                self.__add_to_history(chat_id, role="assistant", content=contents[0])
+                answer = ''.join(f'{index + 1}\u20e3\n{content}\n\n' for index, content in enumerate(contents))
+            else:
+                answer = (response.choices[0].message.content or '').strip()
+                self.__add_to_history(chat_id, role="assistant", content=answer)
+
+            bot_language = self.config['bot_language']
+            show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
+            plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
+            if self.config['show_usage']:
+                answer += "\n\n---\n" \
+                          f"💰 {response.usage.total_tokens} {localized_text('stats_tokens', bot_language)}" \
+                          f" ({response.usage.prompt_tokens} {localized_text('prompt', bot_language)}," \
+                          f" {response.usage.completion_tokens} {localized_text('completion', bot_language)})"
+                if show_plugins_used:
+                    answer += f"\n🔌 {', '.join(plugin_names)}"
+            elif show_plugins_used:
+                answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
+
+            return answer, response.usage.total_tokens
 
     async def get_chat_response_stream(self, chat_id: int, query: str):
         """
@@ -178,36 +235,37 @@ class OpenAIHelper:
         :param query: The query to send to the model
         :return: The answer from the model and the number of tokens used, or 'not_finished'
         """
-        plugins_used = ()
-        response = await self.__common_get_chat_response(chat_id, query, stream=True)
-        if self.config['enable_functions'] and not self.conversations_vision[chat_id]:
-            response, plugins_used = await self.__handle_function_call(chat_id, response, stream=True)
-            if is_direct_result(response):
-                yield response, '0'
-                return
-
-        answer = ''
-        async for chunk in response:
-            if len(chunk.choices) == 0:
-                continue
-            delta = chunk.choices[0].delta
-            if delta.content:
-                answer += delta.content
-                yield answer, 'not_finished'
-        answer = answer.strip()
-        self.__add_to_history(chat_id, role="assistant", content=answer)
-        tokens_used = str(self.__count_tokens(self.conversations[chat_id]))
-
-        show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
-        plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
-        if self.config['show_usage']:
-            answer += f"\n\n---\n💰 {tokens_used} {localized_text('stats_tokens', self.config['bot_language'])}"
-            if show_plugins_used:
-                answer += f"\n🔌 {', '.join(plugin_names)}"
-        elif show_plugins_used:
-            answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
-
-        yield answer, tokens_used
+        with self.__request_in_flight(chat_id):
+            plugins_used = ()
+            response = await self.__common_get_chat_response(chat_id, query, stream=True)
+            if self.config['enable_functions'] and not self.conversations_vision[chat_id]:
+                response, plugins_used = await self.__handle_function_call(chat_id, response, stream=True)
+                if is_direct_result(response):
+                    yield response, '0'
+                    return
+
+            answer = ''
+            async for chunk in response:
+                if len(chunk.choices) == 0:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    answer += delta.content
+                    yield answer, 'not_finished'
+            answer = answer.strip()
+            self.__add_to_history(chat_id, role="assistant", content=answer)
+            tokens_used = str(self.__count_tokens(self.conversations[chat_id]))
+
+            show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
+            plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
+            if self.config['show_usage']:
+                answer += f"\n\n---\n💰 {tokens_used} {localized_text('stats_tokens', self.config['bot_language'])}"
+                if show_plugins_used:
+                    answer += f"\n🔌 {', '.join(plugin_names)}"
+            elif show_plugins_used:
+                answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
+
+            yield answer, tokens_used
 
     @retry(
         reraise=True,
@@ -225,6 +283,7 @@ class OpenAIHelper:
         bot_language = self.config['bot_language']
         try:
             if chat_id not in self.conversations or self.__max_age_reached(chat_id):
+                self.__evict_expired_conversations()
                 self.reset_chat_history(chat_id)
 
             self.last_updated[chat_id] = datetime.datetime.now()
@@ -232,25 +291,29 @@ class OpenAIHelper:
             self.__add_to_history(chat_id, role="user", content=query)
 
             # Summarize the chat history if it's too long to avoid excessive token usage
-            token_count = self.__count_tokens(self.conversations[chat_id])
+            conversation = self.conversations[chat_id]
+            token_count = self.__count_tokens(conversation)
             exceeded_max_tokens = token_count + self.config['max_tokens'] > self.__max_model_tokens()
-            exceeded_max_history_size = len(self.conversations[chat_id]) > self.config['max_history_size']
+            exceeded_max_history_size = len(conversation) > self.config['max_history_size']
 
             if exceeded_max_tokens or exceeded_max_history_size:
-                logging.info(f'Chat history for chat ID {chat_id} is too long. Summarising...')
+                logging.info('Chat history for chat ID %s is too long. Summarising...', chat_id)
                 try:
-                    summary = await self.__summarise(self.conversations[chat_id][:-1])
-                    logging.debug(f'Summary: {summary}')
-                    self.reset_chat_history(chat_id, self.conversations[chat_id][0]['content'])
+                    summary = await self.__summarise(conversation[:-1])
+                    logging.debug('Summary: %s', summary)
+                    self.reset_chat_history(chat_id, conversation[0]['content'])
                     self.__add_to_history(chat_id, role="assistant", content=summary)
                     self.__add_to_history(chat_id, role="user", content=query)
                 except Exception as e:
-                    logging.warning(f'Error while summarising chat history: {str(e)}. Popping elements instead...')
-                    self.conversations[chat_id] = self.conversations[chat_id][-self.config['max_history_size']:]
+                    logging.warning('Error while summarising chat history: %s. Popping elements instead...', e)
+                    self.__trim_history(chat_id)
+                # both paths replace the history list
+                conversation = self.conversations[chat_id]
 
+            is_vision = self.conversations_vision[chat_id]
             common_args = {
-                'model': self.config['model'] if not self.conversations_vision[chat_id] else self.config['vision_model'],
-                'messages': self.conversations[chat_id],
+                'model': self.config['model'] if not is_vision else self.config['vision_model'],
+                'messages': conversation,
                 'temperature': self.config['temperature'],
                 'n': self.config['n_choices'],
                 'max_tokens': self.config['max_tokens'],
@@ -259,10 +322,10 @@ class OpenAIHelper:
                 'stream': stream
             }
 
-            if self.config['enable_functions'] and not self.conversations_vision[chat_id]:
+            if self.config['enable_functions'] and not is_vision:
                 functions = self.plugin_manager.get_functions_specs()
                 if len(functions) > 0:
-                    common_args['functions'] = self.plugin_manager.get_functions_specs()
+                    common_args['functions'] = functions
                     common_args['function_call'] = 'auto'
             return await self.client.chat.completions.create(**common_args)
 
@@ -279,20 +342,25 @@ class OpenAIHelper:
         function_name = ''
         arguments = ''
         if stream:
+            # streamed function calls arrive in many small fragments, join them once at the end
+            function_name_parts = []
+            arguments_parts = []
             async for item in response:
                 if len(item.choices) > 0:
                     first_choice = item.choices[0]
                     if first_choice.delta and first_choice.delta.function_call:
                         if first_choice.delta.function_call.name:
-                            function_name += first_choice.delta.function_call.name
+                            function_name_parts.append(first_choice.delta.function_call.name)
                         if first_choice.delta.function_call.arguments:
-                            arguments += first_choice.delta.function_call.arguments
+                            arguments_parts.append(first_choice.delta.function_call.arguments)
                     elif first_choice.finish_reason and first_choice.finish_reason == 'function_call':
                         break
                     else:
                         return response, plugins_used
                 else:
                     return response, plugins_used
+            function_name = ''.join(function_name_parts)
+            arguments = ''.join(arguments_parts)
         else:
             if len(response.choices) > 0:
                 first_choice = response.choices[0]
@@ -306,7 +374,7 @@ class OpenAIHelper:
             else:
                 return response, plugins_used
 
-        logging.info(f'Calling function {function_name} with arguments {arguments}')
+        logging.info('Calling function %s with arguments %s', function_name, arguments)
         function_response = await self.plugin_manager.call_function(function_name, self, arguments)
 
         if function_name not in plugins_used:
@@ -346,7 +414,7 @@ class OpenAIHelper:
             )
 
             if len(response.data) == 0:
-                logging.error(f'No response from GPT: {str(response)}')
+                logging.error('No response from GPT: %s', response)
                 raise Exception(
                     f"⚠️ _{localized_text('error', bot_language)}._ "
                     f"⚠️\n{localized_text('try_again', bot_language)}."
@@ -407,6 +475,7 @@ class OpenAIHelper:
         bot_language = self.config['bot_language']
         try:
             if chat_id not in self.conversations or self.__max_age_reached(chat_id):
+                self.__evict_expired_conversations()
                 self.reset_chat_history(chat_id)
 
             self.last_updated[chat_id] = datetime.datetime.now()
@@ -427,24 +496,28 @@ class OpenAIHelper:
             exceeded_max_history_size = len(self.conversations[chat_id]) > self.config['max_history_size']
 
             if exceeded_max_tokens or exceeded_max_history_size:
-                logging.info(f'Chat history for chat ID {chat_id} is too long. Summarising...')
+                logging.info('Chat history for chat ID %s is too long. Summarising...', chat_id)
                 try:
                     
                     last = self.conversations[chat_id][-1]
                     summary = await self.__summarise(self.conversations[chat_id][:-1])
-                    logging.debug(f'Summary: {summary}')
+                    logging.debug('Summary: %s', summary)
                     self.reset_chat_history(chat_id, self.conversations[chat_id][0]['content'])
                     self.__add_to_history(chat_id, role="assistant", content=summary)
                     self.conversations[chat_id] += [last]
                 except Exception as e:
-                    logging.warning(f'Error while summarising chat history: {str(e)}. Popping elements instead...')
-                    self.conversations[chat_id] = self.conversations[chat_id][-self.config['max_history_size']:]
+                    logging.warning('Error while summarising chat history: %s. Popping elements instead...', e)
+                    self.__trim_history(chat_id)
 
-            message = {'role':'user', 'content':content}
+            if self.config['enable_vision_follow_up_questions']:
+                # the image message is already the last entry of the history, no need to copy it
+                messages = self.conversations[chat_id]
+            else:
+                messages = self.conversations[chat_id][:-1] + [{'role': 'user', 'content': content}]
 
             common_args = {
                 'model': self.config['vision_model'],
-                'messages': self.conversations[chat_id][:-1] + [message],
+                'messages': messages,
                 'temperature': self.config['temperature'],
                 'n': 1, # several choices is not implemented yet
                 'max_tokens': self.config['vision_max_tokens'],
@@ -478,95 +551,93 @@ class OpenAIHelper:
         """
         Interprets a given PNG image file using the Vision model.
         """
-        image = encode_image(fileobj)
-        prompt = self.config['vision_prompt'] if prompt is None else prompt
+        with self.__request_in_flight(chat_id):
+            image = encode_image(fileobj)
+            prompt = self.config['vision_prompt'] if prompt is None else prompt
 
-        content = [{'type':'text', 'text':prompt}, {'type':'image_url', \
-                    'image_url': {'url':image, 'detail':self.config['vision_detail'] } }]
+            content = [{'type':'text', 'text':prompt}, {'type':'image_url', \
+                        'image_url': {'url':image, 'detail':self.config['vision_detail'] } }]
 
-        response = await self.__common_get_chat_response_vision(chat_id, content)
+            response = await self.__common_get_chat_response_vision(chat_id, content)
 
         
 
-        # functions are not available for this model
+            # functions are not available for this model
         
-        # if self.config['enable_functions']:
-        #     response, plugins_used = await self.__handle_function_call(chat_id, response)
-        #     if is_direct_result(response):
-        #         return response, '0'
-
-        answer = ''
-
-        if len(response.choices) > 1 and self.config['n_choices'] > 1:
-            for index, choice in enumerate(response.choices):
-                content = choice.message.content.strip()
-                if index == 0:
-                    self.__add_to_history(chat_id, role="assistant", content=content)
-                answer += f'{index + 1}\u20e3\n'
-                answer += content
-                answer += '\n\n'
-        else:
-            answer = response.choices[0].message.content.strip()
-            self.__add_to_history(chat_id, role="assistant", content=answer)
+            # if self.config['enable_functions']:
+            #     response, plugins_used = await self.__handle_function_call(chat_id, response)
+            #     if is_direct_result(response):
+            #         return response, '0'
 
-        bot_language = self.config['bot_language']
-        # Plugins are not enabled either
-        # show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
-        # plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
-        if self.config['show_usage']:
-            answer += "\n\n---\n" \
-                      f"💰 {str(response.usage.total_tokens)} {localized_text('stats_tokens', bot_language)}" \
-                      f" ({str(response.usage.prompt_tokens)} {localized_text('prompt', bot_language)}," \
-                      f" {str(response.usage.completion_tokens)} {localized_text('completion', bot_language)})"
-            # if show_plugins_used:
-            #     answer += f"\n🔌 {', '.join(plugin_names)}"
-        # elif show_plugins_used:
-        #     answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
-
-        return answer, response.usage.total_tokens
+            answer = ''
+
+            if len(response.choices) > 1 and self.config['n_choices'] > 1:
+                contents = [(choice.message.content or '').strip() for choice in response.choices]
+                self.__add_to_history(chat_id, role="assistant", content=contents[0])
+                answer = ''.join(f'{index + 1}\u20e3\n{content}\n\n' for index, content in enumerate(contents))
+            else:
+                answer = (response.choices[0].message.content or '').strip()
+                self.__add_to_history(chat_id, role="assistant", content=answer)
+
+            bot_language = self.config['bot_language']
+            # Plugins are not enabled either
+            # show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
+            # plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
+            if self.config['show_usage']:
+                answer += "\n\n---\n" \
+                          f"💰 {response.usage.total_tokens} {localized_text('stats_tokens', bot_language)}" \
+                          f" ({response.usage.prompt_tokens} {localized_text('prompt', bot_language)}," \
+                          f" {response.usage.completion_tokens} {localized_text('completion', bot_language)})"
+                # if show_plugins_used:
+                #     answer += f"\n🔌 {', '.join(plugin_names)}"
+            # elif show_plugins_used:
+            #     answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
+
+            return answer, response.usage.total_tokens
 
     async def interpret_image_stream(self, chat_id, fileobj, prompt=None):
         """
         Interprets a given PNG image file using the Vision model.
         """
-        image = encode_image(fileobj)
-        prompt = self.config['vision_prompt'] if prompt is None else prompt
+        with self.__request_in_flight(chat_id):
+            image = encode_image(fileobj)
+            prompt = self.config['vision_prompt'] if prompt is None else prompt
 
-        content = [{'type':'text', 'text':prompt}, {'type':'image_url', \
-                    'image_url': {'url':image, 'detail':self.config['vision_detail'] } }]
+            content = [{'type':'text', 'text':prompt}, {'type':'image_url', \
+                        'image_url': {'url':image, 'detail':self.config['vision_detail'] } }]
 
-        response = await self.__common_get_chat_response_vision(chat_id, content, stream=True)
+            response = await self.__common_get_chat_response_vision(chat_id, content, stream=True)
 
         
 
-        # if self.config['enable_functions']:
-        #     response, plugins_used = await self.__handle_function_call(chat_id, response, stream=True)
-        #     if is_direct_result(response):
-        #         yield response, '0'
-        #         return
-
-        answer = ''
-        async for chunk in response:
-            if len(chunk.choices) == 0:
-                continue
-            delta = chunk.choices[0].delta
-            if delta.content:
-                answer += delta.content
-                yield answer, 'not_finished'
-        answer = answer.strip()
-        self.__add_to_history(chat_id, role="assistant", content=answer)
-        tokens_used = str(self.__count_tokens(self.conversations[chat_id]))
-
-        #show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
-        #plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
-        if self.config['show_usage']:
-            answer += f"\n\n---\n💰 {tokens_used} {localized_text('stats_tokens', self.config['bot_language'])}"
-        #     if show_plugins_used:
-        #         answer += f"\n🔌 {', '.join(plugin_names)}"
-        # elif show_plugins_used:
-        #     answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
-
-        yield answer, tokens_used
+            # if self.config['enable_functions']:
+            #     response, plugins_used = await self.__handle_function_call(chat_id, response, stream=True)
+            #     if is_direct_result(response):
+            #         yield response, '0'
+            #         return
+
+            answer = ''
+            async for chunk in response:
+                if len(chunk.choices) == 0:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    answer += delta.content
+                    yield answer, 'not_finished'
+            answer = answer.strip()
+            self.__add_to_history(chat_id, role="assistant", content=answer)
+            tokens_used = str(self.__count_tokens(self.conversations[chat_id]))
+
+            #show_plugins_used = len(plugins_used) > 0 and self.config['show_plugins_used']
+            #plugin_names = tuple(self.plugin_manager.get_plugin_source_name(plugin) for plugin in plugins_used)
+            if self.config['show_usage']:
+                answer += f"\n\n---\n💰 {tokens_used} {localized_text('stats_tokens', self.config['bot_language'])}"
+            #     if show_plugins_used:
+            #         answer += f"\n🔌 {', '.join(plugin_names)}"
+            # elif show_plugins_used:
+            #     answer += f"\n\n---\n🔌 {', '.join(plugin_names)}"
+
+            yield answer, tokens_used
 
     def reset_chat_history(self, chat_id, content=''):
         """
@@ -574,8 +645,27 @@ class OpenAIHelper:
         """
         if content == '':
             content = self.config['assistant_prompt']
+        if chat_id in self.conversations:
+            self.__forget_token_counts(self.conversations[chat_id])
         self.conversations[chat_id] = [{"role": "system", "content": content}]
         self.conversations_vision[chat_id] = False
+        self.last_updated[chat_id] = datetime.datetime.now()
+
+    @contextlib.contextmanager
+    def __request_in_flight(self, chat_id):
+        """
+        Marks a request of the chat as in flight, so that its conversation is not evicted meanwhile.
+        :param chat_id: The chat ID
+        """
+        self.active_requests[chat_id] = self.active_requests.get(chat_id, 0) + 1
+        try:
+            yield
+        finally:
+            remaining = self.active_requests[chat_id] - 1
+            if remaining:
+                self.active_requests[chat_id] = remaining
+            else:
+                del self.active_requests[chat_id]
 
     def __max_age_reached(self, chat_id) -> bool:
         """
@@ -590,6 +680,32 @@ class OpenAIHelper:
         max_age_minutes = self.config['max_conversation_age_minutes']
         return last_updated < now - datetime.timedelta(minutes=max_age_minutes)
 
+    def __evict_expired_conversations(self):
+        """
+        Drops all conversations whose maximum age has been reached, so that inactive chats
+        do not stay in memory. They would be reset on their next message anyway.
+        Chats with a request in flight are kept, since the request still appends to their history.
+        """
+        max_age = datetime.timedelta(minutes=self.config['max_conversation_age_minutes'])
+        cutoff = datetime.datetime.now() - max_age
+        expired = [chat_id for chat_id, last_updated in self.last_updated.items()
+                   if last_updated < cutoff and chat_id not in self.active_requests]
+        for chat_id in expired:
+            self.__forget_token_counts(self.conversations.pop(chat_id, ()))
+            self.conversations_vision.pop(chat_id, None)
+            self.last_updated.pop(chat_id, None)
+
+    def __trim_history(self, chat_id):
+        """
+        Trims the conversation history to the maximum history size, keeping the system prompt.
+        :param chat_id: The chat ID
+        """
+        history = self.conversations[chat_id]
+        keep = max(self.config['max_history_size'] - 1, 1)
+        first_kept = max(1, len(history) - keep)
+        self.__forget_token_counts(history[1:first_kept])
+        self.conversations[chat_id] = history[:1] + history[first_kept:]
+
     def __add_function_call_to_history(self, chat_id, function_name, content):
         """
         Adds a function call to the conversation history
@@ -623,24 +739,12 @@ class OpenAIHelper:
         return response.choices[0].message.content
 
     def __max_model_tokens(self):
-        base = 4096
-        if self.config['model'] in GPT_3_MODELS:
-            return base
-        if self.config['model'] in GPT_3_16K_MODELS:
-            return base * 4
-        if self.config['model'] in GPT_4_MODELS:
-            return base * 2
-        if self.config['model'] in GPT_4_32K_MODELS:
-            return base * 8
-        if self.config['model'] in GPT_4_VISION_MODELS:
-            return base * 31
-        if self.config['model'] in GPT_4_128K_MODELS:
-            return base * 31
-        if self.config['model'] in GPT_4O_MODELS:
-            return base * 31
-        raise NotImplementedError(
-            f"Max tokens for model {self.config['model']} is not implemented yet."
-        )
+        spec = MODEL_SPECS.get(self.config['model'])
+        if spec is None:
+            raise NotImplementedError(
+                f"Max tokens for model {self.config['model']} is not implemented yet."
+            )
+        return spec.max_tokens
 
     # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
     def __count_tokens(self, messages) -> int:
@@ -650,40 +754,67 @@ class OpenAIHelper:
         :return: the number of tokens required
         """
         model = self.config['model']
-        try:
-            encoding = tiktoken.encoding_for_model(model)
-        except KeyError:
-            encoding = tiktoken.get_encoding("gpt-3.5-turbo")
-
-        if model in GPT_3_MODELS + GPT_3_16K_MODELS:
-            tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
-            tokens_per_name = -1  # if there's a name, the role is omitted
-        elif model in GPT_4_MODELS + GPT_4_32K_MODELS + GPT_4_VISION_MODELS + GPT_4_128K_MODELS + GPT_4O_MODELS:
-            tokens_per_message = 3
-            tokens_per_name = 1
-        else:
+        encoding = get_encoding(model)
+
+        spec = MODEL_SPECS.get(model)
+        if spec is None:
             raise NotImplementedError(f"""num_tokens_from_messages() is not implemented for model {model}.""")
+        tokens_per_message = spec.tokens_per_message  # 4 for gpt-3.5: <|start|>{role/name}\n{content}<|end|>\n
+        tokens_per_name = spec.tokens_per_name  # -1 for gpt-3.5: if there's a name, the role is omitted
         num_tokens = 0
+        # history messages are never modified, so each one only needs to be encoded once
+        new_messages = []
         for message in messages:
-            num_tokens += tokens_per_message
+            cached = self.token_counts.get(id(message))
+            if cached is not None and cached[0] is message:
+                num_tokens += cached[1]
+            else:
+                new_messages.append(message)
+
+        # all text fragments are collected first and encoded together
+        counts = []
+        texts = []
+        text_owners = []
+        for index, message in enumerate(new_messages):
+            count = tokens_per_message
             for key, value in message.items():
-                if key == 'content':
-                    if isinstance(value, str):
-                        num_tokens += len(encoding.encode(value))
-                    else:
-                        for message1 in value:
-                            if message1['type'] == 'image_url':
-                                image = decode_image(message1['image_url']['url'])
-                                num_tokens += self.__count_tokens_vision(image)
-                            else:
-                                num_tokens += len(encoding.encode(message1['text']))
+                if key == 'content' and not isinstance(value, str):
+                    for message1 in value:
+                        if message1['type'] == 'image_url':
+                            image = decode_image(message1['image_url']['url'])
+                            count += self.__count_tokens_vision(image)
+                        else:
+                            texts.append(message1['text'])
+                            text_owners.append(index)
                 else:
-                    num_tokens += len(encoding.encode(value))
+                    texts.append(value)
+                    text_owners.append(index)
                     if key == "name":
-                        num_tokens += tokens_per_name
+                        count += tokens_per_name
+            counts.append(count)
+
+        # encode_batch spins up a thread pool per call, which only pays off for larger batches
+        if len(texts) >= ENCODE_BATCH_MIN_SIZE:
+            encoded = encoding.encode_batch(texts)
+        else:
+            encoded = [encoding.encode(text) for text in texts]
+        for index, tokens in zip(text_owners, encoded):
+            counts[index] += len(tokens)
+
+        for message, count in zip(new_messages, counts):
+            self.token_counts[id(message)] = (message, count)
+            num_tokens += count
         num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
         return num_tokens
 
+    def __forget_token_counts(self, messages):
+        """
+        Removes the cached token counts of messages that are no longer part of a conversation.
+        :param messages: the messages to forget
+        """
+        for message in messages:
+            self.token_counts.pop(id(message), None)
+
     # no longer needed
 
     def __count_tokens_vision(self, image_bytes: bytes) -> int:
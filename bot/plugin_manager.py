@@ -1,4 +1,4 @@
-import json
+from json_utils import json_dumps, json_loads
 
 from plugins.gtts_text_to_speech import GTTSTextToSpeech
 from plugins.auto_tts import AutoTextToSpeech
@@ -44,12 +44,18 @@ class PluginManager:
             'iplocation': IpLocationPlugin,
         }
         self.plugins = [plugin_mapping[plugin]() for plugin in enabled_plugins if plugin in plugin_mapping]
+        # plugin specs are static, so they are collected once instead of on every request
+        self.functions_specs = [spec for specs in map(lambda plugin: plugin.get_spec(), self.plugins) for spec in specs]
+        self.plugins_by_function_name = {}
+        for plugin in self.plugins:
+            for spec in plugin.get_spec():
+                self.plugins_by_function_name.setdefault(spec.get('name'), plugin)
 
     def get_functions_specs(self):
         """
         Return the list of function specs that can be called by the model
         """
-        return [spec for specs in map(lambda plugin: plugin.get_spec(), self.plugins) for spec in specs]
+        return self.functions_specs
 
     async def call_function(self, function_name, helper, arguments):
         """
@@ -57,8 +63,8 @@ class PluginManager:
         """
         plugin = self.__get_plugin_by_function_name(function_name)
         if not plugin:
-            return json.dumps({'error': f'Function {function_name} not found'})
-        return json.dumps(await plugin.execute(function_name, helper, **json.loads(arguments)), default=str)
+            return json_dumps({'error': f'Function {function_name} not found'}).decode('utf-8')
+        return json_dumps(await plugin.execute(function_name, helper, **json_loads(arguments))).decode('utf-8')
 
     def get_plugin_source_name(self, function_name) -> str:
         """
@@ -70,5 +76,4 @@ class PluginManager:
         return plugin.get_source_name()
 
     def __get_plugin_by_function_name(self, function_name):
-        return next((plugin for plugin in self.plugins
-                    if function_name in map(lambda spec: spec.get('name'), plugin.get_spec())), None)
+        return self.plugins_by_function_name.get(function_name)
@@ -1,8 +1,7 @@
+import asyncio
 from typing import Dict
 
-import requests
-
-from .plugin import Plugin
+from .plugin import Plugin, http_session
 
 
 # Author: https://github.com/stumpyfr
@@ -27,4 +26,5 @@ class CryptoPlugin(Plugin):
         }]
 
     async def execute(self, function_name, helper, **kwargs) -> Dict:
-        return requests.get(f"https://api.coincap.io/v2/rates/{kwargs['asset']}").json()
+        response = await asyncio.to_thread(http_session.get, f"https://api.coincap.io/v2/rates/{kwargs['asset']}")
+        return response.json()
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import random
 from itertools import islice
@@ -52,13 +53,17 @@ class DDGImageSearchPlugin(Plugin):
     async def execute(self, function_name, helper, **kwargs) -> Dict:
         with DDGS() as ddgs:
             image_type = kwargs.get('type', 'photo')
-            ddgs_images_gen = ddgs.images(
-                kwargs['query'],
-                region=kwargs.get('region', 'wt-wt'),
-                safesearch=self.safesearch,
-                type_image=image_type,
-            )
-            results = list(islice(ddgs_images_gen, 10))
+
+            def search():
+                ddgs_images_gen = ddgs.images(
+                    kwargs['query'],
+                    region=kwargs.get('region', 'wt-wt'),
+                    safesearch=self.safesearch,
+                    type_image=image_type,
+                )
+                return list(islice(ddgs_images_gen, 10))
+
+            results = await asyncio.to_thread(search)
             if not results or len(results) == 0:
                 return {"result": "No results found"}
 
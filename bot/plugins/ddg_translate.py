@@ -1,3 +1,4 @@
+import asyncio
 from typing import Dict
 
 from duckduckgo_search import DDGS
@@ -28,4 +29,4 @@ class DDGTranslatePlugin(Plugin):
 
     async def execute(self, function_name, helper, **kwargs) -> Dict:
         with DDGS() as ddgs:
-            return ddgs.translate(kwargs['text'], to=kwargs['to_language'])
+            return await asyncio.to_thread(ddgs.translate, kwargs['text'], to=kwargs['to_language'])
@@ -1,3 +1,4 @@
+import asyncio
 import os
 from itertools import islice
 from typing import Dict
@@ -48,12 +49,15 @@ class DDGWebSearchPlugin(Plugin):
 
     async def execute(self, function_name, helper, **kwargs) -> Dict:
         with DDGS() as ddgs:
-            ddgs_gen = ddgs.text(
-                kwargs['query'],
-                region=kwargs.get('region', 'wt-wt'),
-                safesearch=self.safesearch
-            )
-            results = list(islice(ddgs_gen, 3))
+            def search():
+                ddgs_gen = ddgs.text(
+                    kwargs['query'],
+                    region=kwargs.get('region', 'wt-wt'),
+                    safesearch=self.safesearch
+                )
+                return list(islice(ddgs_gen, 3))
+
+            results = await asyncio.to_thread(search)
 
             if results is None or len(results) == 0:
                 return {"Result": "No good DuckDuckGo Search Result was found"}
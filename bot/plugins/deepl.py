@@ -1,9 +1,8 @@
+import asyncio
 import os
 from typing import Dict
 
-import requests
-
-from .plugin import Plugin
+from .plugin import Plugin, http_session
 
 
 class DeeplTranslatePlugin(Plugin):
@@ -49,5 +48,6 @@ class DeeplTranslatePlugin(Plugin):
             "text": kwargs['text'],
             "target_lang": kwargs['to_language']
         }
-        translated_text = requests.post(url, headers=headers, data=data).json()["translations"][0]["text"]
+        response = await asyncio.to_thread(http_session.post, url, headers=headers, data=data)
+        translated_text = response.json()["translations"][0]["text"]
         return translated_text.encode('unicode-escape').decode('unicode-escape')
\ No newline at end of file
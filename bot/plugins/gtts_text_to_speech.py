@@ -1,3 +1,4 @@
+import asyncio
 import datetime
 from typing import Dict
 
@@ -34,7 +35,7 @@ class GTTSTextToSpeech(Plugin):
     async def execute(self, function_name, helper, **kwargs) -> Dict:
         tts = gTTS(kwargs['text'], lang=kwargs.get('lang', 'en'))
         output = f'gtts_{datetime.datetime.now().timestamp()}.mp3'
-        tts.save(output)
+        await asyncio.to_thread(tts.save, output)
         return {
             'direct_result': {
                 'kind': 'file',
@@ -1,7 +1,7 @@
-import requests
+import asyncio
 from typing import Dict
 
-from .plugin import Plugin
+from .plugin import Plugin, http_session
 
 
 class IpLocationPlugin(Plugin):
@@ -30,7 +30,7 @@ class IpLocationPlugin(Plugin):
         BASE_URL = "https://api.ip.fm/?ip={}"
         url = BASE_URL.format(ip)
         try:
-            response = requests.get(url)
+            response = await asyncio.to_thread(http_session.get, url)
             response_data = response.json()
             country = response_data.get('data', {}).get('country', "None")
             subdivisions = response_data.get('data', {}).get('subdivisions', "None")
@@ -1,6 +1,13 @@
 from abc import abstractmethod, ABC
 from typing import Dict
 
+import requests
+from requests.adapters import HTTPAdapter
+
+# HTTP session shared by all plugins, so that connections to their APIs are pooled and kept alive
+http_session = requests.Session()
+http_session.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=16))
+
 
 class Plugin(ABC):
     """
@@ -1,6 +1,7 @@
-import os, requests, random, string
+import asyncio
+import os, random, string
 from typing import Dict
-from .plugin import Plugin
+from .plugin import Plugin, http_session
 
 class WebshotPlugin(Plugin):
     """
@@ -31,14 +32,13 @@ class WebshotPlugin(Plugin):
             image_url = f'https://image.thum.io/get/maxAge/12/width/720/{kwargs["url"]}'
             
             # preload url first
-            requests.get(image_url)
+            await asyncio.to_thread(http_session.get, image_url)
 
             # download the actual image
-            response = requests.get(image_url, timeout=30)
+            response = await asyncio.to_thread(http_session.get, image_url, timeout=30)
 
             if response.status_code == 200:
-                if not os.path.exists("uploads/webshot"):
-                    os.makedirs("uploads/webshot")
+                os.makedirs("uploads/webshot", exist_ok=True)
 
                 image_file_path = os.path.join("uploads/webshot", f"{self.generate_random_string(15)}.png")
                 with open(image_file_path, "wb") as f:
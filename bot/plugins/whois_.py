@@ -1,3 +1,4 @@
+import asyncio
 from typing import Dict
 from .plugin import Plugin
 
@@ -26,7 +27,7 @@ class WhoisPlugin(Plugin):
 
     async def execute(self, function_name, helper, **kwargs) -> Dict:
         try:
-            whois_result = whois.query(kwargs['domain'])
+            whois_result = await asyncio.to_thread(whois.query, kwargs['domain'])
             if whois_result is None:
                 return {'result': 'No such domain found'}
             return whois_result.__dict__
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import re
 from typing import Dict
@@ -31,10 +32,7 @@ class YouTubeAudioExtractorPlugin(Plugin):
     async def execute(self, function_name, helper, **kwargs) -> Dict:
         link = kwargs['youtube_link']
         try:
-            video = YouTube(link)
-            audio = video.streams.filter(only_audio=True, file_extension='mp4').first()
-            output = re.sub(r'[^\w\-_\. ]', '_', video.title) + '.mp3'
-            audio.download(filename=output)
+            output = await asyncio.to_thread(self.download_audio, link)
             return {
                 'direct_result': {
                     'kind': 'file',
@@ -43,5 +41,16 @@ class YouTubeAudioExtractorPlugin(Plugin):
                 }
             }
         except Exception as e:
-            logging.warning(f'Failed to extract audio from YouTube video: {str(e)}')
+            logging.warning('Failed to extract audio from YouTube video: %s', e)
             return {'result': 'Failed to extract audio'}
+
+    @staticmethod
+    def download_audio(link) -> str:
+        """
+        Download the audio track of a YouTube video and return the path of the file
+        """
+        video = YouTube(link)
+        audio = video.streams.filter(only_audio=True, file_extension='mp4').first()
+        output = re.sub(r'[^\w\-_\. ]', '_', video.title) + '.mp3'
+        audio.download(filename=output)
+        return output
@@ -19,10 +19,17 @@ from PIL import Image
 from utils import is_group_chat, get_thread_id, message_text, wrap_with_indicator, split_into_chunks, \
     edit_message_with_retry, get_stream_cutoff_values, is_allowed, get_remaining_budget, is_admin, is_within_budget, \
     get_reply_to_message_id, add_chat_request_to_usage_tracker, error_handler, is_direct_result, handle_direct_result, \
-    cleanup_intermediate_files
+    cleanup_intermediate_files, split_config_list
 from openai_helper import OpenAIHelper, localized_text
 from usage_tracker import UsageTracker
 
+# Update filters of the message handlers, composed once at import
+GROUP_CHAT_FILTER = filters.ChatType.GROUP | filters.ChatType.SUPERGROUP
+VISION_FILTER = filters.PHOTO | filters.Document.IMAGE
+TRANSCRIBE_FILTER = filters.AUDIO | filters.VOICE | filters.Document.AUDIO | \
+                    filters.VIDEO | filters.VIDEO_NOTE | filters.Document.VIDEO
+PROMPT_FILTER = filters.TEXT & (~filters.COMMAND)
+
 
 class ChatGPTTelegramBot:
     """
@@ -56,6 +63,11 @@ class ChatGPTTelegramBot:
         )] + self.commands
         self.disallowed_message = localized_text('disallowed', bot_language)
         self.budget_limit_message = localized_text('budget_limit', bot_language)
+        self.reset_done_message = localized_text('reset_done', bot_language)
+        self.resend_failed_message = localized_text('resend_failed', bot_language)
+        self.chat_fail_message = localized_text('chat_fail', bot_language)
+        self.trigger_keyword_lower = self.config['group_trigger_keyword'].lower()
+        self.voice_reply_prefixes = tuple(prefix.lower() for prefix in self.config['voice_reply_prompts'] if prefix)
         self.usage = {}
         self.last_message = {}
         self.inline_queries_cache = {}
@@ -83,13 +95,13 @@ class ChatGPTTelegramBot:
         Returns token usage statistics for current day and month.
         """
         if not await is_allowed(self.config, update, context):
-            logging.warning(f'User {update.message.from_user.name} (id: {update.message.from_user.id}) '
-                            'is not allowed to request their usage statistics')
+            logging.warning('User %s (id: %s) is not allowed to request their usage statistics',
+                            update.message.from_user.name, update.message.from_user.id)
             await self.send_disallowed_message(update, context)
             return
 
-        logging.info(f'User {update.message.from_user.name} (id: {update.message.from_user.id}) '
-                     'requested their usage statistics')
+        logging.info('User %s (id: %s) requested their usage statistics',
+                     update.message.from_user.name, update.message.from_user.id)
 
         user_id = update.message.from_user.id
         if user_id not in self.usage:
@@ -189,24 +201,24 @@ class ChatGPTTelegramBot:
         Resend the last request
         """
         if not await is_allowed(self.config, update, context):
-            logging.warning(f'User {update.message.from_user.name}  (id: {update.message.from_user.id})'
-                            ' is not allowed to resend the message')
+            logging.warning('User %s  (id: %s) is not allowed to resend the message',
+                            update.message.from_user.name, update.message.from_user.id)
             await self.send_disallowed_message(update, context)
             return
 
         chat_id = update.effective_chat.id
         if chat_id not in self.last_message:
-            logging.warning(f'User {update.message.from_user.name} (id: {update.message.from_user.id})'
-                            ' does not have anything to resend')
+            logging.warning('User %s (id: %s) does not have anything to resend',
+                            update.message.from_user.name, update.message.from_user.id)
             await update.effective_message.reply_text(
                 message_thread_id=get_thread_id(update),
-                text=localized_text('resend_failed', self.config['bot_language'])
+                text=self.resend_failed_message
             )
             return
 
         # Update message text, clear self.last_message and send the request to prompt
-        logging.info(f'Resending the last prompt from user: {update.message.from_user.name} '
-                     f'(id: {update.message.from_user.id})')
+        logging.info('Resending the last prompt from user: %s (id: %s)',
+                     update.message.from_user.name, update.message.from_user.id)
         with update.message._unfrozen() as message:
             message.text = self.last_message.pop(chat_id)
 
@@ -217,20 +229,20 @@ class ChatGPTTelegramBot:
         Resets the conversation.
         """
         if not await is_allowed(self.config, update, context):
-            logging.warning(f'User {update.message.from_user.name} (id: {update.message.from_user.id}) '
-                            'is not allowed to reset the conversation')
+            logging.warning('User %s (id: %s) is not allowed to reset the conversation',
+                            update.message.from_user.name, update.message.from_user.id)
             await self.send_disallowed_message(update, context)
             return
 
-        logging.info(f'Resetting the conversation for user {update.message.from_user.name} '
-                     f'(id: {update.message.from_user.id})...')
+        logging.info('Resetting the conversation for user %s (id: %s)...',
+                     update.message.from_user.name, update.message.from_user.id)
 
         chat_id = update.effective_chat.id
         reset_content = message_text(update.message)
         self.openai.reset_chat_history(chat_id=chat_id, content=reset_content)
         await update.effective_message.reply_text(
             message_thread_id=get_thread_id(update),
-            text=localized_text('reset_done', self.config['bot_language'])
+            text=self.reset_done_message
         )
 
     async def image(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -249,8 +261,8 @@ class ChatGPTTelegramBot:
             )
             return
 
-        logging.info(f'New image generation request received from user {update.message.from_user.name} '
-                     f'(id: {update.message.from_user.id})')
+        logging.info('New image generation request received from user %s (id: %s)',
+                     update.message.from_user.name, update.message.from_user.id)
 
         async def _generate():
             try:
@@ -271,7 +283,7 @@ class ChatGPTTelegramBot:
                 user_id = update.message.from_user.id
                 self.usage[user_id].add_image_request(image_size, self.config['image_prices'])
                 # add guest chat request to guest usage tracker
-                if str(user_id) not in self.config['allowed_user_ids'].split(',') and 'guests' in self.usage:
+                if str(user_id) not in split_config_list(self.config['allowed_user_ids']) and 'guests' in self.usage:
                     self.usage["guests"].add_image_request(image_size, self.config['image_prices'])
 
             except Exception as e:
@@ -301,8 +313,8 @@ class ChatGPTTelegramBot:
             )
             return
 
-        logging.info(f'New speech generation request received from user {update.message.from_user.name} '
-                     f'(id: {update.message.from_user.id})')
+        logging.info('New speech generation request received from user %s (id: %s)',
+                     update.message.from_user.name, update.message.from_user.id)
 
         async def _generate():
             try:
@@ -317,7 +329,7 @@ class ChatGPTTelegramBot:
                 user_id = update.message.from_user.id
                 self.usage[user_id].add_tts_request(text_length, self.config['tts_model'], self.config['tts_prices'])
                 # add guest chat request to guest usage tracker
-                if str(user_id) not in self.config['allowed_user_ids'].split(',') and 'guests' in self.usage:
+                if str(user_id) not in split_config_list(self.config['allowed_user_ids']) and 'guests' in self.usage:
                     self.usage["guests"].add_tts_request(text_length, self.config['tts_model'], self.config['tts_prices'])
 
             except Exception as e:
@@ -367,8 +379,8 @@ class ChatGPTTelegramBot:
             try:
                 audio_track = AudioSegment.from_file(filename)
                 audio_track.export(filename_mp3, format="mp3")
-                logging.info(f'New transcribe request received from user {update.message.from_user.name} '
-                             f'(id: {update.message.from_user.id})')
+                logging.info('New transcribe request received from user %s (id: %s)',
+                             update.message.from_user.name, update.message.from_user.id)
 
             except Exception as e:
                 logging.exception(e)
@@ -377,8 +389,10 @@ class ChatGPTTelegramBot:
                     reply_to_message_id=get_reply_to_message_id(self.config, update),
                     text=localized_text('media_type_fail', bot_language)
                 )
-                if os.path.exists(filename):
+                try:
                     os.remove(filename)
+                except FileNotFoundError:
+                    pass
                 return
 
             user_id = update.message.from_user.id
@@ -391,13 +405,12 @@ class ChatGPTTelegramBot:
                 transcription_price = self.config['transcription_price']
                 self.usage[user_id].add_transcription_seconds(audio_track.duration_seconds, transcription_price)
 
-                allowed_user_ids = self.config['allowed_user_ids'].split(',')
+                allowed_user_ids = split_config_list(self.config['allowed_user_ids'])
                 if str(user_id) not in allowed_user_ids and 'guests' in self.usage:
                     self.usage["guests"].add_transcription_seconds(audio_track.duration_seconds, transcription_price)
 
                 # check if transcript starts with any of the prefixes
-                response_to_transcription = any(transcript.lower().startswith(prefix.lower()) if prefix else False
-                                                for prefix in self.config['voice_reply_prompts'])
+                response_to_transcription = transcript.lower().startswith(self.voice_reply_prefixes)
 
                 if self.config['voice_reply_transcript'] and not response_to_transcription:
 
@@ -444,10 +457,11 @@ class ChatGPTTelegramBot:
                     parse_mode=constants.ParseMode.MARKDOWN
                 )
             finally:
-                if os.path.exists(filename_mp3):
-                    os.remove(filename_mp3)
-                if os.path.exists(filename):
-                    os.remove(filename)
+                for path in (filename_mp3, filename):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
 
         await wrap_with_indicator(update, context, _execute, constants.ChatAction.TYPING)
 
@@ -468,7 +482,7 @@ class ChatGPTTelegramBot:
             else:
                 trigger_keyword = self.config['group_trigger_keyword']
                 if (prompt is None and trigger_keyword != '') or \
-                   (prompt is not None and not prompt.lower().startswith(trigger_keyword.lower())):
+                   (prompt is not None and not prompt.lower().startswith(self.trigger_keyword_lower)):
                     logging.info('Vision coming from group chat with wrong keyword, ignoring...')
                     return
         
@@ -501,8 +515,8 @@ class ChatGPTTelegramBot:
                 original_image = Image.open(temp_file)
                 
                 original_image.save(temp_file_png, format='PNG')
-                logging.info(f'New vision request received from user {update.message.from_user.name} '
-                             f'(id: {update.message.from_user.id})')
+                logging.info('New vision request received from user %s (id: %s)',
+                             update.message.from_user.name, update.message.from_user.id)
 
             except Exception as e:
                 logging.exception(e)
@@ -531,7 +545,7 @@ class ChatGPTTelegramBot:
                     if is_direct_result(content):
                         return await handle_direct_result(self.config, update, content)
 
-                    if len(content.strip()) == 0:
+                    if not content or content.isspace():
                         continue
 
                     stream_chunks = split_into_chunks(content)
@@ -637,7 +651,7 @@ class ChatGPTTelegramBot:
             vision_token_price = self.config['vision_token_price']
             self.usage[user_id].add_vision_tokens(total_tokens, vision_token_price)
 
-            allowed_user_ids = self.config['allowed_user_ids'].split(',')
+            allowed_user_ids = split_config_list(self.config['allowed_user_ids'])
             if str(user_id) not in allowed_user_ids and 'guests' in self.usage:
                 self.usage["guests"].add_vision_tokens(total_tokens, vision_token_price)
 
@@ -653,38 +667,43 @@ class ChatGPTTelegramBot:
         if not await self.check_allowed_and_within_budget(update, context):
             return
 
-        logging.info(
-            f'New message received from user {update.message.from_user.name} (id: {update.message.from_user.id})')
+        message = update.message
+        user = message.from_user
+        user_id = user.id
+        logging.info('New message received from user %s (id: %s)', user.name, user_id)
         chat_id = update.effective_chat.id
-        user_id = update.message.from_user.id
-        prompt = message_text(update.message)
+        prompt = message_text(message)
         self.last_message[chat_id] = prompt
 
         if is_group_chat(update):
             trigger_keyword = self.config['group_trigger_keyword']
+            reply_to_message = message.reply_to_message
 
-            if prompt.lower().startswith(trigger_keyword.lower()) or update.message.text.lower().startswith('/chat'):
-                if prompt.lower().startswith(trigger_keyword.lower()):
+            starts_with_trigger_keyword = prompt.lower().startswith(self.trigger_keyword_lower)
+            if starts_with_trigger_keyword or message.text[:5].lower() == '/chat':
+                if starts_with_trigger_keyword:
                     prompt = prompt[len(trigger_keyword):].strip()
 
-                if update.message.reply_to_message and \
-                        update.message.reply_to_message.text and \
-                        update.message.reply_to_message.from_user.id != context.bot.id:
-                    prompt = f'"{update.message.reply_to_message.text}" {prompt}'
+                if reply_to_message and \
+                        reply_to_message.text and \
+                        reply_to_message.from_user.id != context.bot.id:
+                    prompt = f'"{reply_to_message.text}" {prompt}'
             else:
-                if update.message.reply_to_message and update.message.reply_to_message.from_user.id == context.bot.id:
+                if reply_to_message and reply_to_message.from_user.id == context.bot.id:
                     logging.info('Message is a reply to the bot, allowing...')
                 else:
                     logging.warning('Message does not start with trigger keyword, ignoring...')
                     return
 
+        thread_id = get_thread_id(update)
+        reply_to_message_id = get_reply_to_message_id(self.config, update)
         try:
             total_tokens = 0
 
             if self.config['stream']:
                 await update.effective_message.reply_chat_action(
                     action=constants.ChatAction.TYPING,
-                    message_thread_id=get_thread_id(update)
+                    message_thread_id=thread_id
                 )
 
                 stream_response = self.openai.get_chat_response_stream(chat_id=chat_id, query=prompt)
@@ -698,7 +717,7 @@ class ChatGPTTelegramBot:
                     if is_direct_result(content):
                         return await handle_direct_result(self.config, update, content)
 
-                    if len(content.strip()) == 0:
+                    if not content or content.isspace():
                         continue
 
                     stream_chunks = split_into_chunks(content)
@@ -713,7 +732,7 @@ class ChatGPTTelegramBot:
                                 pass
                             try:
                                 sent_message = await update.effective_message.reply_text(
-                                    message_thread_id=get_thread_id(update),
+                                    message_thread_id=thread_id,
                                     text=content if len(content) > 0 else "..."
                                 )
                             except:
@@ -729,8 +748,8 @@ class ChatGPTTelegramBot:
                                 await context.bot.delete_message(chat_id=sent_message.chat_id,
                                                                  message_id=sent_message.message_id)
                             sent_message = await update.effective_message.reply_text(
-                                message_thread_id=get_thread_id(update),
-                                reply_to_message_id=get_reply_to_message_id(self.config, update),
+                                message_thread_id=thread_id,
+                                reply_to_message_id=reply_to_message_id,
                                 text=content,
                             )
                         except:
@@ -778,18 +797,16 @@ class ChatGPTTelegramBot:
                     for index, chunk in enumerate(chunks):
                         try:
                             await update.effective_message.reply_text(
-                                message_thread_id=get_thread_id(update),
-                                reply_to_message_id=get_reply_to_message_id(self.config,
-                                                                            update) if index == 0 else None,
+                                message_thread_id=thread_id,
+                                reply_to_message_id=reply_to_message_id if index == 0 else None,
                                 text=chunk,
                                 parse_mode=constants.ParseMode.MARKDOWN
                             )
                         except Exception:
                             try:
                                 await update.effective_message.reply_text(
-                                    message_thread_id=get_thread_id(update),
-                                    reply_to_message_id=get_reply_to_message_id(self.config,
-                                                                                update) if index == 0 else None,
+                                    message_thread_id=thread_id,
+                                    reply_to_message_id=reply_to_message_id if index == 0 else None,
                                     text=chunk
                                 )
                             except Exception as exception:
@@ -802,9 +819,9 @@ class ChatGPTTelegramBot:
         except Exception as e:
             logging.exception(e)
             await update.effective_message.reply_text(
-                message_thread_id=get_thread_id(update),
-                reply_to_message_id=get_reply_to_message_id(self.config, update),
-                text=f"{localized_text('chat_fail', self.config['bot_language'])} {str(e)}",
+                message_thread_id=thread_id,
+                reply_to_message_id=reply_to_message_id,
+                text=f"{self.chat_fail_message} {str(e)}",
                 parse_mode=constants.ParseMode.MARKDOWN
             )
 
@@ -850,7 +867,7 @@ class ChatGPTTelegramBot:
 
             await update.inline_query.answer([inline_query_result], cache_time=0)
         except Exception as e:
-            logging.error(f'An error occurred while generating the result card for inline query {e}')
+            logging.error('An error occurred while generating the result card for inline query %s', e)
 
     async def handle_callback_inline_query(self, update: Update, context: CallbackContext):
         """
@@ -900,7 +917,7 @@ class ChatGPTTelegramBot:
                                                           is_inline=True)
                             return
 
-                        if len(content.strip()) == 0:
+                        if not content or content.isspace():
                             continue
 
                         cutoff = get_stream_cutoff_values(update, content)
@@ -954,7 +971,7 @@ class ChatGPTTelegramBot:
                                                             text=f'{query}\n\n_{answer_tr}:_\n{loading_tr}',
                                                             parse_mode=constants.ParseMode.MARKDOWN)
 
-                        logging.info(f'Generating response for inline query by {name}')
+                        logging.info('Generating response for inline query by %s', name)
                         response, total_tokens = await self.openai.get_chat_response(chat_id=user_id, query=query)
 
                         if is_direct_result(response):
@@ -980,11 +997,10 @@ class ChatGPTTelegramBot:
                 add_chat_request_to_usage_tracker(self.usage, self.config, user_id, total_tokens)
 
         except Exception as e:
-            logging.error(f'Failed to respond to an inline query via button callback: {e}')
+            logging.error('Failed to respond to an inline query via button callback: %s', e)
             logging.exception(e)
-            localized_answer = localized_text('chat_fail', self.config['bot_language'])
             await edit_message_with_retry(context, chat_id=None, message_id=inline_message_id,
-                                          text=f"{query}\n\n_{answer_tr}:_\n{localized_answer} {str(e)}",
+                                          text=f"{query}\n\n_{answer_tr}:_\n{self.chat_fail_message} {str(e)}",
                                           is_inline=True)
 
     async def check_allowed_and_within_budget(self, update: Update, context: ContextTypes.DEFAULT_TYPE,
@@ -996,15 +1012,16 @@ class ChatGPTTelegramBot:
         :param is_inline: Boolean flag for inline queries
         :return: Boolean indicating if the user is allowed to use the bot
         """
-        name = update.inline_query.from_user.name if is_inline else update.message.from_user.name
-        user_id = update.inline_query.from_user.id if is_inline else update.message.from_user.id
+        user = update.inline_query.from_user if is_inline else update.message.from_user
+        name = user.name
+        user_id = user.id
 
         if not await is_allowed(self.config, update, context, is_inline=is_inline):
-            logging.warning(f'User {name} (id: {user_id}) is not allowed to use the bot')
+            logging.warning('User %s (id: %s) is not allowed to use the bot', name, user_id)
             await self.send_disallowed_message(update, context, is_inline)
             return False
         if not is_within_budget(self.config, self.usage, update, is_inline=is_inline):
-            logging.warning(f'User {name} (id: {user_id}) reached their usage limit')
+            logging.warning('User %s (id: %s) reached their usage limit', name, user_id)
             await self.send_budget_reached_message(update, context, is_inline)
             return False
 
@@ -1044,6 +1061,20 @@ class ChatGPTTelegramBot:
         await application.bot.set_my_commands(self.group_commands, scope=BotCommandScopeAllGroupChats())
         await application.bot.set_my_commands(self.commands)
 
+    async def post_shutdown(self, application: Application) -> None:
+        """
+        Post shutdown hook for the bot.
+        """
+        try:
+            # write pending usage updates before the event loop goes away
+            for user_id, usage_tracker in self.usage.items():
+                try:
+                    await usage_tracker.flush()
+                except Exception:
+                    logging.exception('Failed to write usage of user %s', user_id)
+        finally:
+            await self.openai.close()
+
     def run(self):
         """
         Runs the bot indefinitely until the user presses Ctrl+C
@@ -1053,6 +1084,7 @@ class ChatGPTTelegramBot:
             .proxy_url(self.config['proxy']) \
             .get_updates_proxy_url(self.config['proxy']) \
             .post_init(self.post_init) \
+            .post_shutdown(self.post_shutdown) \
             .concurrent_updates(True) \
             .build()
 
@@ -1063,17 +1095,10 @@ class ChatGPTTelegramBot:
         application.add_handler(CommandHandler('start', self.help))
         application.add_handler(CommandHandler('stats', self.stats))
         application.add_handler(CommandHandler('resend', self.resend))
-        application.add_handler(CommandHandler(
-            'chat', self.prompt, filters=filters.ChatType.GROUP | filters.ChatType.SUPERGROUP)
-        )
-        application.add_handler(MessageHandler(
-            filters.PHOTO | filters.Document.IMAGE,
-            self.vision))
-        application.add_handler(MessageHandler(
-            filters.AUDIO | filters.VOICE | filters.Document.AUDIO |
-            filters.VIDEO | filters.VIDEO_NOTE | filters.Document.VIDEO,
-            self.transcribe))
-        application.add_handler(MessageHandler(filters.TEXT & (~filters.COMMAND), self.prompt))
+        application.add_handler(CommandHandler('chat', self.prompt, filters=GROUP_CHAT_FILTER))
+        application.add_handler(MessageHandler(VISION_FILTER, self.vision))
+        application.add_handler(MessageHandler(TRANSCRIBE_FILTER, self.transcribe))
+        application.add_handler(MessageHandler(PROMPT_FILTER, self.prompt))
         application.add_handler(InlineQueryHandler(self.inline_query, chat_types=[
             constants.ChatType.GROUP, constants.ChatType.SUPERGROUP, constants.ChatType.PRIVATE
         ]))
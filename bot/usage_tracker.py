@@ -1,8 +1,16 @@
-import os.path
+import asyncio
+import atexit
+import logging
+import os
 import pathlib
-import json
+import threading
 from datetime import date
 
+from json_utils import json_dumps, json_loads
+
+# Delay in seconds used to coalesce several usage updates into a single write
+SAVE_DELAY_SECONDS = 0.1
+
 
 def year_month(date_str):
     # extract string of year-month from date, eg: '2023-03'
@@ -39,6 +47,8 @@ class UsageTracker:
         }
     }
     """
+    # one tracker per user is kept for the lifetime of the bot
+    __slots__ = ('user_id', 'logs_dir', 'user_file', 'usage', '_dirty', '_save_handle', '_write_future')
 
     def __init__(self, user_id, user_name, logs_dir="usage_logs"):
         """
@@ -52,10 +62,14 @@ class UsageTracker:
         self.logs_dir = logs_dir
         # path to usage file of given user
         self.user_file = f"{logs_dir}/{user_id}.json"
-
-        if os.path.isfile(self.user_file):
-            with open(self.user_file, "r") as file:
-                self.usage = json.load(file)
+        self._dirty = False
+        self._save_handle = None
+        self._write_future = None
+        atexit.register(self.save)
+
+        data = self._read()
+        if data:
+            self.usage = json_loads(data)
             if 'vision_tokens' not in self.usage['usage_history']:
                 self.usage['usage_history']['vision_tokens'] = {}
             if 'tts_characters' not in self.usage['usage_history']:
@@ -70,6 +84,85 @@ class UsageTracker:
                 "usage_history": {"chat_tokens": {}, "transcription_seconds": {}, "number_images": {}, "tts_characters": {}, "vision_tokens":{}}
             }
 
+    # persistence functions:
+
+    def schedule_save(self):
+        """Marks the usage as modified and schedules a write to the user file.
+        Updates arriving within SAVE_DELAY_SECONDS are coalesced into a single write,
+        which is performed in the default executor to keep the event loop free.
+        Without a running event loop the usage is written immediately.
+        """
+        self._dirty = True
+        if self._save_handle is not None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        self._save_handle = loop.call_later(SAVE_DELAY_SECONDS, self._save_in_background)
+
+    def _save_in_background(self):
+        self._save_handle = None
+        if not self._dirty:
+            return
+        if self._write_future is not None and not self._write_future.done():
+            # wait for the previous write to finish so that writes stay ordered
+            self.schedule_save()
+            return
+        self._dirty = False
+        # serialize on the event loop, so the snapshot is consistent, and only write in the executor
+        data = json_dumps(self.usage)
+        self._write_future = asyncio.get_running_loop().run_in_executor(None, self._write, data)
+        self._write_future.add_done_callback(self._on_write_done)
+
+    def _on_write_done(self, future):
+        if future.cancelled() or future.exception() is None:
+            return
+        logging.error('Failed to write usage of user %s', self.user_id, exc_info=future.exception())
+        # the update has not been persisted, so the next scheduled save or flush retries it
+        self._dirty = True
+
+    def save(self):
+        """Writes the usage to the user file if it has been modified since the last write.
+        """
+        if self._save_handle is not None:
+            self._save_handle.cancel()
+            self._save_handle = None
+        if not self._dirty:
+            return
+        self._dirty = False
+        self._write(json_dumps(self.usage))
+
+    async def flush(self):
+        """Waits for a running background write, then writes any remaining changes.
+        Used on shutdown, so that an older snapshot still being written cannot replace the final one.
+        """
+        if self._write_future is not None:
+            await asyncio.wait((self._write_future,))
+        self.save()
+
+    def _read(self) -> bytes:
+        """Reads the user file with a single open and read.
+        :return: the file content, or empty bytes if the file does not exist or is empty
+        """
+        try:
+            fd = os.open(self.user_file, os.O_RDONLY)
+        except FileNotFoundError:
+            return b''
+        try:
+            size = os.fstat(fd).st_size
+            return os.read(fd, size) if size else b''
+        finally:
+            os.close(fd)
+
+    def _write(self, data: bytes):
+        # write to a temporary file and rename it, so that an interrupted write never truncates the user file
+        tmp_file = f"{self.user_file}.{threading.get_ident()}.tmp"
+        with open(tmp_file, "wb") as outfile:
+            outfile.write(data)
+        os.replace(tmp_file, self.user_file)
+
     # token usage functions:
 
     def add_chat_tokens(self, tokens, tokens_price=0.002):
@@ -90,24 +183,18 @@ class UsageTracker:
             self.usage["usage_history"]["chat_tokens"][str(today)] = tokens
 
         # write updated token usage to user file
-        with open(self.user_file, "w") as outfile:
-            json.dump(self.usage, outfile)
+        self.schedule_save()
 
     def get_current_token_usage(self):
         """Get token amounts used for today and this month
 
         :return: total number of tokens used per day and per month
         """
-        today = date.today()
-        if str(today) in self.usage["usage_history"]["chat_tokens"]:
-            usage_day = self.usage["usage_history"]["chat_tokens"][str(today)]
-        else:
-            usage_day = 0
-        month = str(today)[:7]  # year-month as string
-        usage_month = 0
-        for today, tokens in self.usage["usage_history"]["chat_tokens"].items():
-            if today.startswith(month):
-                usage_month += tokens
+        today = str(date.today())
+        chat_tokens = self.usage["usage_history"]["chat_tokens"]
+        usage_day = chat_tokens.get(today, 0)
+        month = today[:7]  # year-month as string
+        usage_month = sum(tokens for day, tokens in chat_tokens.items() if day.startswith(month))
         return usage_day, usage_month
 
     # image usage functions:
@@ -135,24 +222,18 @@ class UsageTracker:
             self.usage["usage_history"]["number_images"][str(today)][requested_size] += 1
 
         # write updated image number to user file
-        with open(self.user_file, "w") as outfile:
-            json.dump(self.usage, outfile)
+        self.schedule_save()
 
     def get_current_image_count(self):
         """Get number of images requested for today and this month.
 
         :return: total number of images requested per day and per month
         """
-        today = date.today()
-        if str(today) in self.usage["usage_history"]["number_images"]:
-            usage_day = sum(self.usage["usage_history"]["number_images"][str(today)])
-        else:
-            usage_day = 0
-        month = str(today)[:7]  # year-month as string
-        usage_month = 0
-        for today, images in self.usage["usage_history"]["number_images"].items():
-            if today.startswith(month):
-                usage_month += sum(images)
+        today = str(date.today())
+        number_images = self.usage["usage_history"]["number_images"]
+        usage_day = sum(number_images.get(today, ()))
+        month = today[:7]  # year-month as string
+        usage_month = sum(sum(images) for day, images in number_images.items() if day.startswith(month))
         return usage_day, usage_month
 
 
@@ -176,24 +257,18 @@ class UsageTracker:
             self.usage["usage_history"]["vision_tokens"][str(today)] = tokens
 
         # write updated token usage to user file
-        with open(self.user_file, "w") as outfile:
-            json.dump(self.usage, outfile)
+        self.schedule_save()
 
     def get_current_vision_tokens(self):
         """Get vision tokens for today and this month.
 
         :return: total amount of vision tokens per day and per month
         """
-        today = date.today()
-        if str(today) in self.usage["usage_history"]["vision_tokens"]:
-            tokens_day = self.usage["usage_history"]["vision_tokens"][str(today)]
-        else:
-            tokens_day = 0
-        month = str(today)[:7]  # year-month as string
-        tokens_month = 0
-        for today, tokens in self.usage["usage_history"]["vision_tokens"].items():
-            if today.startswith(month):
-                tokens_month += tokens
+        today = str(date.today())
+        vision_tokens = self.usage["usage_history"]["vision_tokens"]
+        tokens_day = vision_tokens.get(today, 0)
+        month = today[:7]  # year-month as string
+        tokens_month = sum(tokens for day, tokens in vision_tokens.items() if day.startswith(month))
         return tokens_day, tokens_month
 
     # tts usage functions:
@@ -220,8 +295,7 @@ class UsageTracker:
             self.usage["usage_history"]["tts_characters"][tts_model][str(today)] = text_length
 
         # write updated token usage to user file
-        with open(self.user_file, "w") as outfile:
-            json.dump(self.usage, outfile)
+        self.schedule_save()
 
     def get_current_tts_usage(self):
         """Get length of speech generated for today and this month.
@@ -230,20 +304,14 @@ class UsageTracker:
         """
 
         tts_models = ['tts-1', 'tts-1-hd']
-        today = date.today()
-        characters_day = 0
-        for tts_model in tts_models:
-            if tts_model in self.usage["usage_history"]["tts_characters"] and \
-                str(today) in self.usage["usage_history"]["tts_characters"][tts_model]:
-                characters_day += self.usage["usage_history"]["tts_characters"][tts_model][str(today)]
-
-        month = str(today)[:7]  # year-month as string
-        characters_month = 0
-        for tts_model in tts_models:
-            if tts_model in self.usage["usage_history"]["tts_characters"]: 
-                for today, characters in self.usage["usage_history"]["tts_characters"][tts_model].items():
-                    if today.startswith(month):
-                        characters_month += characters
+        today = str(date.today())
+        tts_characters = self.usage["usage_history"]["tts_characters"]
+        model_usages = [tts_characters[tts_model] for tts_model in tts_models if tts_model in tts_characters]
+        characters_day = sum(model_usage.get(today, 0) for model_usage in model_usages)
+
+        month = today[:7]  # year-month as string
+        characters_month = sum(characters for model_usage in model_usages
+                               for day, characters in model_usage.items() if day.startswith(month))
         return int(characters_day), int(characters_month)
 
 
@@ -267,8 +335,7 @@ class UsageTracker:
             self.usage["usage_history"]["transcription_seconds"][str(today)] = seconds
 
         # write updated token usage to user file
-        with open(self.user_file, "w") as outfile:
-            json.dump(self.usage, outfile)
+        self.schedule_save()
 
     def add_current_costs(self, request_cost):
         """
@@ -278,8 +345,10 @@ class UsageTracker:
         last_update = date.fromisoformat(self.usage["current_cost"]["last_update"])
 
         # add to all_time cost, initialize with calculation of total_cost if key doesn't exist
-        self.usage["current_cost"]["all_time"] = \
-            self.usage["current_cost"].get("all_time", self.initialize_all_time_cost()) + request_cost
+        all_time_cost = self.usage["current_cost"].get("all_time")
+        if all_time_cost is None:
+            all_time_cost = self.initialize_all_time_cost()
+        self.usage["current_cost"]["all_time"] = all_time_cost + request_cost
         # add current cost, update new day
         if today == last_update:
             self.usage["current_cost"]["day"] += request_cost
@@ -297,16 +366,11 @@ class UsageTracker:
 
         :return: total amount of time transcribed per day and per month (4 values)
         """
-        today = date.today()
-        if str(today) in self.usage["usage_history"]["transcription_seconds"]:
-            seconds_day = self.usage["usage_history"]["transcription_seconds"][str(today)]
-        else:
-            seconds_day = 0
-        month = str(today)[:7]  # year-month as string
-        seconds_month = 0
-        for today, seconds in self.usage["usage_history"]["transcription_seconds"].items():
-            if today.startswith(month):
-                seconds_month += seconds
+        today = str(date.today())
+        transcription_seconds = self.usage["usage_history"]["transcription_seconds"]
+        seconds_day = transcription_seconds.get(today, 0)
+        month = today[:7]  # year-month as string
+        seconds_month = sum(seconds for day, seconds in transcription_seconds.items() if day.startswith(month))
         minutes_day, seconds_day = divmod(seconds_day, 60)
         minutes_month, seconds_month = divmod(seconds_month, 60)
         return int(minutes_day), round(seconds_day, 2), int(minutes_month), round(seconds_month, 2)
@@ -329,7 +393,9 @@ class UsageTracker:
             else:
                 cost_month = 0.0
         # add to all_time cost, initialize with calculation of total_cost if key doesn't exist
-        cost_all_time = self.usage["current_cost"].get("all_time", self.initialize_all_time_cost())
+        cost_all_time = self.usage["current_cost"].get("all_time")
+        if cost_all_time is None:
+            cost_all_time = self.initialize_all_time_cost()
         return {"cost_today": cost_day, "cost_month": cost_month, "cost_all_time": cost_all_time}
 
     def initialize_all_time_cost(self, tokens_price=0.002, image_prices="0.016,0.018,0.02", minute_price=0.006, vision_token_price=0.01, tts_prices='0.015,0.030'):
@@ -2,16 +2,26 @@ from __future__ import annotations
 
 import asyncio
 import itertools
-import json
 import logging
 import os
 import base64
+import functools
 
 import telegram
 from telegram import Message, MessageEntity, Update, ChatMember, constants
 from telegram.ext import CallbackContext, ContextTypes
 
 from usage_tracker import UsageTracker
+from json_utils import json_loads
+
+
+@functools.lru_cache(maxsize=32)
+def split_config_list(value: str) -> tuple[str, ...]:
+    """
+    Splits a comma separated config value, e.g. the allowed user ids.
+    Config values never change at runtime, so each value is only split once.
+    """
+    return tuple(value.split(','))
 
 
 def message_text(message: Message) -> str:
@@ -82,6 +92,9 @@ def split_into_chunks(text: str, chunk_size: int = 4096) -> list[str]:
     """
     Splits a string into chunks of a given size.
     """
+    if len(text) <= chunk_size:
+        # most replies fit into a single message
+        return [text] if text else []
     return [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)]
 
 
@@ -133,7 +146,7 @@ async def edit_message_with_retry(context: ContextTypes.DEFAULT_TYPE, chat_id: i
                 text=text,
             )
         except Exception as e:
-            logging.warning(f'Failed to edit message: {str(e)}')
+            logging.warning('Failed to edit message: %s', e)
             raise e
 
     except Exception as e:
@@ -145,7 +158,7 @@ async def error_handler(_: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Handles errors in the telegram-python-bot library.
     """
-    logging.error(f'Exception while handling an update: {context.error}')
+    logging.error('Exception while handling an update: %s', context.error)
 
 
 async def is_allowed(config, update: Update, context: CallbackContext, is_inline=False) -> bool:
@@ -159,21 +172,20 @@ async def is_allowed(config, update: Update, context: CallbackContext, is_inline
     if is_admin(config, user_id):
         return True
     name = update.inline_query.from_user.name if is_inline else update.message.from_user.name
-    allowed_user_ids = config['allowed_user_ids'].split(',')
+    allowed_user_ids = split_config_list(config['allowed_user_ids'])
     # Check if user is allowed
     if str(user_id) in allowed_user_ids:
         return True
     # Check if it's a group a chat with at least one authorized member
     if not is_inline and is_group_chat(update):
-        admin_user_ids = config['admin_user_ids'].split(',')
+        admin_user_ids = split_config_list(config['admin_user_ids'])
         for user in itertools.chain(allowed_user_ids, admin_user_ids):
             if not user.strip():
                 continue
             if await is_user_in_group(update, context, user):
-                logging.info(f'{user} is a member. Allowing group chat message...')
+                logging.info('%s is a member. Allowing group chat message...', user)
                 return True
-        logging.info(f'Group chat messages from user {name} '
-                     f'(id: {user_id}) are not allowed')
+        logging.info('Group chat messages from user %s (id: %s) are not allowed', name, user_id)
     return False
 
 
@@ -187,7 +199,7 @@ def is_admin(config, user_id: int, log_no_admin=False) -> bool:
             logging.info('No admin user defined.')
         return False
 
-    admin_user_ids = config['admin_user_ids'].split(',')
+    admin_user_ids = split_config_list(config['admin_user_ids'])
 
     # Check if user is in the admin user list
     if str(user_id) in admin_user_ids:
@@ -208,7 +220,7 @@ def get_user_budget(config, user_id) -> float | None:
     if is_admin(config, user_id) or config['user_budgets'] == '*':
         return float('inf')
 
-    user_budgets = config['user_budgets'].split(',')
+    user_budgets = split_config_list(config['user_budgets'])
     if config['allowed_user_ids'] == '*':
         # same budget for all users, use value in first position of budget list
         if len(user_budgets) > 1:
@@ -216,11 +228,11 @@ def get_user_budget(config, user_id) -> float | None:
                             'only the first value is used as budget for everyone.')
         return float(user_budgets[0])
 
-    allowed_user_ids = config['allowed_user_ids'].split(',')
+    allowed_user_ids = split_config_list(config['allowed_user_ids'])
     if str(user_id) in allowed_user_ids:
         user_index = allowed_user_ids.index(str(user_id))
         if len(user_budgets) <= user_index:
-            logging.warning(f'No budget set for user id: {user_id}. Budget list shorter than user list.')
+            logging.warning('No budget set for user id: %s. Budget list shorter than user list.', user_id)
             return 0.0
         return float(user_budgets[user_index])
     return None
@@ -271,10 +283,7 @@ def is_within_budget(config, usage, update: Update, is_inline=False) -> bool:
     :param is_inline: Boolean flag for inline queries
     :return: Boolean indicating if the user has a positive budget
     """
-    user_id = update.inline_query.from_user.id if is_inline else update.message.from_user.id
-    name = update.inline_query.from_user.name if is_inline else update.message.from_user.name
-    if user_id not in usage:
-        usage[user_id] = UsageTracker(user_id, name)
+    # get_remaining_budget already resolves the user and initializes the usage trackers
     remaining_budget = get_remaining_budget(config, usage, update, is_inline=is_inline)
     return remaining_budget > 0
 
@@ -294,11 +303,11 @@ def add_chat_request_to_usage_tracker(usage, config, user_id, used_tokens):
         # add chat request to users usage tracker
         usage[user_id].add_chat_tokens(used_tokens, config['token_price'])
         # add guest chat request to guest usage tracker
-        allowed_user_ids = config['allowed_user_ids'].split(',')
+        allowed_user_ids = split_config_list(config['allowed_user_ids'])
         if str(user_id) not in allowed_user_ids and 'guests' in usage:
             usage["guests"].add_chat_tokens(used_tokens, config['token_price'])
     except Exception as e:
-        logging.warning(f'Failed to add tokens to usage_logs: {str(e)}')
+        logging.warning('Failed to add tokens to usage_logs: %s', e)
         pass
 
 
@@ -321,8 +330,11 @@ def is_direct_result(response: any) -> bool:
     :return: Boolean indicating if the result is a direct result
     """
     if type(response) is not dict:
+        # direct results are serialized dicts, so other text can be rejected without parsing it
+        if isinstance(response, str) and not response.startswith('{'):
+            return False
         try:
-            json_response = json.loads(response)
+            json_response = json_loads(response)
             return json_response.get('direct_result', False)
         except:
             return False
@@ -335,7 +347,7 @@ async def handle_direct_result(config, update: Update, response: any):
     Handles a direct result from a plugin
     """
     if type(response) is not dict:
-        response = json.loads(response)
+        response = json_loads(response)
 
     result = response['direct_result']
     kind = result['kind']
@@ -369,15 +381,17 @@ def cleanup_intermediate_files(response: any):
     Deletes intermediate files created by plugins
     """
     if type(response) is not dict:
-        response = json.loads(response)
+        response = json_loads(response)
 
     result = response['direct_result']
     format = result['format']
     value = result['value']
 
     if format == 'path':
-        if os.path.exists(value):
+        try:
             os.remove(value)
+        except FileNotFoundError:
+            pass
 
 
 # Function to encode the image